@@ -4,21 +4,40 @@
 """
 
 import os
-from typing import List, Dict
+from typing import List, Dict, FrozenSet
+
+from dotenv import load_dotenv
+
+# Переменные окружения читаются один раз при импорте модуля,
+# поэтому .env должен быть загружен до чтения значений ниже
+load_dotenv()
 
 # ============== SUPABASE ==============
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 
+# ============== POSTGRES (LISTEN/NOTIFY) ==============
+# Прямое подключение к Postgres Supabase (если не задано - опрос по REST)
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
+NOTIFY_CHANNELS = {
+    'core_signals': 'new_signal',      # INSERT в ai_signals
+    'parsed_signals': 'parsed_signal', # INSERT в parsed_signals
+    'commands': 'new_command',         # INSERT в autotrade_commands
+}
+# Без NOTIFY дольше этого интервала (сек) делаем сверку опросом
+NOTIFY_WATCHDOG_INTERVAL = 60
+
 # ============== TELEGRAM ==============
 TG_API_ID = int(os.getenv("TG_API_ID", 0))
 TG_API_HASH = os.getenv("TG_API_HASH", "")
-TARGET_CHAT_IDS = [
-    int(chat_id.strip()) for chat_id in 
-    os.getenv("TARGET_CHAT_IDS", "").split(",") 
+# Сессия в памяти (python tg_session.py), иначе - файл amvera_session.session
+TG_STRING_SESSION = os.getenv("TG_STRING_SESSION", "")
+TARGET_CHAT_IDS: FrozenSet[int] = frozenset(
+    int(chat_id) for chat_id in
+    os.getenv("TARGET_CHAT_IDS", "").split(",")
     if chat_id.strip()
-]
+)
 
 # ============== АВТО-ТОРГОВЛЯ ==============
 AUTOTRADE_RULES = {
@@ -27,9 +46,11 @@ AUTOTRADE_RULES = {
     'DEMO_MODE': True,       # Демо-режим
     'MAX_RISK_PER_TRADE': 0.02,  # 2% риска на сделку
     'DAILY_LOSS_LIMIT': 0.05,    # 5% дневной лимит
+    'MAX_CONCURRENT_TRADES': 5,  # Одновременно исполняемых сигналов
 }
 
 # ============== БИРЖИ ==============
+# subscribe_msg - шаблон, кадры подписки собирает MarketDataClient при старте
 EXCHANGE_CONFIG = [
     {
         'name': 'binance',
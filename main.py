@@ -9,18 +9,23 @@ import sys
 import asyncio
 import logging
 import signal
-from typing import Dict, List
+from collections import OrderedDict
+from typing import Dict, List, Optional
 from datetime import datetime
 
+import asyncpg
+import httpx
+import orjson
 from supabase import create_client
-from dotenv import load_dotenv
 
 # Наши модули
 from telegram_parser import TelegramParser
 from websocket_client import MarketDataClient
+from pg_listener import PgNotifyListener, RESYNC
 from config import (
     SUPABASE_URL, SUPABASE_KEY, ENCRYPTION_KEY,
-    TG_API_ID, TG_API_HASH, TARGET_CHAT_IDS,
+    SUPABASE_DB_URL, NOTIFY_CHANNELS, NOTIFY_WATCHDOG_INTERVAL,
+    TG_API_ID, TG_API_HASH, TG_STRING_SESSION, TARGET_CHAT_IDS,
     AUTOTRADE_RULES, EXCHANGE_CONFIG
 )
 
@@ -35,15 +40,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сколько последних обработанных id помним для отсева повторов
+SEEN_IDS_MAX = 10000
+
+# ============== SQL (asyncpg, кэш подготовленных выражений) ==============
+CORE_SIGNALS_SQL = """
+    SELECT * FROM ai_signals
+    WHERE status = 'new' AND for_autotrade AND confidence >= $1
+    ORDER BY created_at DESC
+    LIMIT 10
+"""
+PARSED_SIGNALS_SQL = """
+    SELECT id, parsed_data FROM parsed_signals
+    WHERE NOT processed AND is_trading_signal
+    ORDER BY saved_at DESC
+    LIMIT 5
+"""
+COMMANDS_SQL = "SELECT id, command, params FROM autotrade_commands WHERE NOT processed"
+
+# NOTIFY передает только id, строки дочитываем пачкой
+CORE_SIGNALS_BY_ID_SQL = """
+    SELECT * FROM ai_signals
+    WHERE id = ANY($1) AND status = 'new' AND for_autotrade AND confidence >= $2
+"""
+PARSED_SIGNALS_BY_ID_SQL = """
+    SELECT id, parsed_data FROM parsed_signals
+    WHERE id = ANY($1) AND NOT processed AND is_trading_signal
+"""
+COMMANDS_BY_ID_SQL = """
+    SELECT id, command, params FROM autotrade_commands
+    WHERE id = ANY($1) AND NOT processed
+"""
+MARK_COMMANDS_SQL = "UPDATE autotrade_commands SET processed = true WHERE id = ANY($1)"
+
+
+async def init_pg_connection(conn: asyncpg.Connection):
+    """json/jsonb колонки возвращаем как Python объекты, а не строки"""
+    for pg_type in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            pg_type,
+            encoder=lambda value: orjson.dumps(value).decode(),
+            decoder=orjson.loads,
+            schema='pg_catalog'
+        )
+
+
 class AmveraExecutor:
     """Главный исполнительный модуль на Amvera"""
     
     def __init__(self):
         self.supabase = None
+        self.supabase_rest = None
         self.telegram_parser = None
         self.market_client = None
+        self.pg_pool = None
+        self.pg_listener = None
         self.is_running = True
+        self.stopped = asyncio.Event()
         self.active_tasks = []
+        self.signal_tasks = set()
+        # Строка может прийти и из сверки, и из NOTIFY - исполняем один раз
+        self.seen_ids = {key: OrderedDict() for key in NOTIFY_CHANNELS}
+        self.trade_semaphore = asyncio.Semaphore(
+            AUTOTRADE_RULES['MAX_CONCURRENT_TRADES']
+        )
         
     async def init(self):
         """Инициализация всех компонентов"""
@@ -52,11 +112,53 @@ class AmveraExecutor:
         # 1. Инициализация Supabase
         try:
             self.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            
+            # Асинхронный HTTP/2 клиент PostgREST для частых вставок
+            self.supabase_rest = httpx.AsyncClient(
+                base_url=f"{SUPABASE_URL}/rest/v1",
+                headers={
+                    "apikey": SUPABASE_KEY,
+                    "Authorization": f"Bearer {SUPABASE_KEY}",
+                    "Content-Type": "application/json",
+                    "Prefer": "return=minimal"
+                },
+                http2=True,
+                timeout=5.0,
+                limits=httpx.Limits(max_keepalive_connections=8)
+            )
             logger.info("✅ Supabase подключен")
         except Exception as e:
             logger.error(f"❌ Ошибка Supabase: {e}")
             return False
             
+        # 1.1 Пул Postgres (иначе - опрос Supabase REST)
+        if SUPABASE_DB_URL:
+            try:
+                self.pg_pool = await asyncpg.create_pool(
+                    SUPABASE_DB_URL,
+                    min_size=2,
+                    max_size=10,
+                    statement_cache_size=256,
+                    init=init_pg_connection
+                )
+                logger.info("✅ Пул Postgres создан")
+            except Exception as e:
+                logger.error(f"❌ Ошибка Postgres, перехожу на опрос REST: {e}")
+                self.pg_pool = None
+                
+        # 1.2 Подписка на NOTIFY (иначе - опрос через пул Postgres)
+        if self.pg_pool:
+            listener = PgNotifyListener(
+                pool=self.pg_pool,
+                channels=list(NOTIFY_CHANNELS.values())
+            )
+            try:
+                await listener.connect()
+                self.pg_listener = listener
+            except Exception as e:
+                logger.error(f"❌ Ошибка LISTEN, перехожу на опрос Postgres: {e}")
+                await listener.close()
+                
         # 2. Инициализация парсера Telegram
         if TG_API_ID and TG_API_HASH:
             try:
@@ -64,7 +166,8 @@ class AmveraExecutor:
                     api_id=TG_API_ID,
                     api_hash=TG_API_HASH,
                     target_chats=TARGET_CHAT_IDS,
-                    supabase=self.supabase
+                    supabase_rest=self.supabase_rest,
+                    session_string=TG_STRING_SESSION
                 )
                 logger.info("✅ Telegram парсер инициализирован")
             except Exception as e:
@@ -74,7 +177,7 @@ class AmveraExecutor:
         try:
             self.market_client = MarketDataClient(
                 exchanges=EXCHANGE_CONFIG,
-                supabase=self.supabase
+                supabase_rest=self.supabase_rest
             )
             logger.info("✅ WebSocket клиент инициализирован")
         except Exception as e:
@@ -112,6 +215,16 @@ class AmveraExecutor:
         self.active_tasks.append(trade_task)
         logger.info("▶️ Торговый цикл запущен")
         
+        # Запускаем обработчики сигналов из NOTIFY
+        if self.pg_listener:
+            for consumer in (self.core_signal_consumer, self.parsed_signal_consumer):
+                consumer_task = asyncio.create_task(
+                    consumer(),
+                    name=consumer.__name__
+                )
+                self.active_tasks.append(consumer_task)
+            logger.info("▶️ Обработчики NOTIFY запущены")
+            
         # Запускаем проверку команд от админа
         command_task = asyncio.create_task(
             self.command_listener(),
@@ -126,11 +239,10 @@ class AmveraExecutor:
         
         while self.is_running:
             try:
-                # 1. Проверяем новые сигналы от ядра (PythonAnywhere)
-                await self.check_core_signals()
-                
-                # 2. Проверяем парсированные сигналы (если еще парсим)
-                await self.check_parsed_signals()
+                # 1-2. Без NOTIFY опрашиваем сигналы ядра и парсера
+                if not self.pg_listener:
+                    await self.check_core_signals()
+                    await self.check_parsed_signals()
                 
                 # 3. Мониторим открытые позиции
                 await self.monitor_positions()
@@ -145,75 +257,225 @@ class AmveraExecutor:
                 logger.error(f"❌ Ошибка в торговом цикле: {e}")
                 await asyncio.sleep(5)
                 
+    def unseen(self, channel_key: str, rows: List) -> List:
+        """Строки, которые еще не обрабатывались"""
+        seen = self.seen_ids[channel_key]
+        return [row for row in rows if row['id'] not in seen]
+        
+    def remember_ids(self, channel_key: str, ids: List):
+        """Запоминаем обработанные id (ограниченно по SEEN_IDS_MAX)"""
+        seen = self.seen_ids[channel_key]
+        for row_id in ids:
+            seen[row_id] = None
+        while len(seen) > SEEN_IDS_MAX:
+            seen.popitem(last=False)
+            
+    def claim_unseen(self, channel_key: str, rows: List) -> List:
+        """Отбираем новые строки и сразу помечаем их как взятые в работу"""
+        rows = self.unseen(channel_key, rows)
+        self.remember_ids(channel_key, [row['id'] for row in rows])
+        return rows
+        
+    async def next_notified_ids(self, channel_key: str) -> Optional[List]:
+        """Ждем NOTIFY и забираем id всех накопившихся строк канала.
+        None - нужна сверка опросом (переподключение LISTEN или долгая тишина)"""
+        queue = self.pg_listener.queues[NOTIFY_CHANNELS[channel_key]]
+        try:
+            ids = [await asyncio.wait_for(queue.get(), NOTIFY_WATCHDOG_INTERVAL)]
+        except asyncio.TimeoutError:
+            return None
+        while not queue.empty():
+            ids.append(queue.get_nowait())
+        if RESYNC in ids:
+            return None
+        return ids
+        
     async def check_core_signals(self):
         """Проверка сигналов от торгового ядра (PythonAnywhere)"""
         try:
             # Ищем непрочитанные сигналы с высокой уверенностью
-            response = self.supabase.table("ai_signals") \
-                .select("*") \
-                .eq("status", "new") \
-                .eq("for_autotrade", True) \
-                .gte("confidence", AUTOTRADE_RULES['MIN_CONFIDENCE']) \
-                .order("created_at", desc=True) \
-                .limit(10) \
-                .execute()
+            if self.pg_pool:
+                signals = await self.pg_pool.fetch(
+                    CORE_SIGNALS_SQL, AUTOTRADE_RULES['MIN_CONFIDENCE']
+                )
+            else:
+                query = self.supabase.table("ai_signals") \
+                    .select("*") \
+                    .eq("status", "new") \
+                    .eq("for_autotrade", True) \
+                    .gte("confidence", AUTOTRADE_RULES['MIN_CONFIDENCE']) \
+                    .order("created_at", desc=True) \
+                    .limit(10)
+                signals = (await asyncio.to_thread(query.execute)).data
+            signals = self.claim_unseen('core_signals', signals)
             
-            for signal in response.data:
-                logger.info(f"📡 Получен сигнал от ядра: {signal}")
-                # TODO: Исполнение сигнала
-                # await self.execute_signal(signal)
+            # Исполняем параллельно, лимит - trade_semaphore
+            await asyncio.gather(
+                *(self.handle_core_signal(signal) for signal in signals)
+            )
                 
         except Exception as e:
             logger.error(f"❌ Ошибка проверки сигналов ядра: {e}")
             
+    async def core_signal_consumer(self):
+        """Обработка сигналов ядра из NOTIFY канала"""
+        # Сигналы, пришедшие пока модуль был остановлен
+        await self.check_core_signals()
+        
+        while self.is_running:
+            ids = await self.next_notified_ids('core_signals')
+            if ids is None:
+                await self.check_core_signals()
+                continue
+                
+            try:
+                signals = await self.pg_pool.fetch(
+                    CORE_SIGNALS_BY_ID_SQL, ids, AUTOTRADE_RULES['MIN_CONFIDENCE']
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения сигналов ядра: {e}")
+                continue
+                
+            for signal in self.claim_unseen('core_signals', signals):
+                # Не ждем исполнения предыдущего сигнала
+                task = asyncio.create_task(self.handle_core_signal(signal))
+                self.signal_tasks.add(task)
+                task.add_done_callback(self.signal_tasks.discard)
+                
+    async def handle_core_signal(self, signal: Dict):
+        """Исполнение сигнала от ядра"""
+        async with self.trade_semaphore:
+            try:
+                logger.info("📡 Получен сигнал от ядра: %s", signal)
+                # TODO: Исполнение сигнала
+                # await self.execute_signal(signal)
+            except Exception as e:
+                logger.error("❌ Ошибка обработки сигнала ядра: %s", e)
+            
     async def check_parsed_signals(self):
         """Проверка парсированных сигналов (временная мера)"""
         try:
-            response = self.supabase.table("parsed_signals") \
-                .select("*") \
-                .eq("processed", False) \
-                .eq("is_trading_signal", True) \
-                .order("saved_at", desc=True) \
-                .limit(5) \
-                .execute()
+            if self.pg_pool:
+                signals = await self.pg_pool.fetch(PARSED_SIGNALS_SQL)
+            else:
+                query = self.supabase.table("parsed_signals") \
+                    .select("id,parsed_data") \
+                    .eq("processed", False) \
+                    .eq("is_trading_signal", True) \
+                    .order("saved_at", desc=True) \
+                    .limit(5)
+                signals = (await asyncio.to_thread(query.execute)).data
             
-            for signal in response.data:
-                logger.info(f"📨 Парсированный сигнал: {signal['parsed_data']}")
-                # TODO: Анализ и исполнение
+            for signal in self.claim_unseen('parsed_signals', signals):
+                await self.handle_parsed_signal(signal)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка проверки парсированных сигналов: {e}")
             
+    async def parsed_signal_consumer(self):
+        """Обработка парсированных сигналов из NOTIFY канала"""
+        await self.check_parsed_signals()
+        
+        while self.is_running:
+            ids = await self.next_notified_ids('parsed_signals')
+            if ids is None:
+                await self.check_parsed_signals()
+                continue
+                
+            try:
+                signals = await self.pg_pool.fetch(PARSED_SIGNALS_BY_ID_SQL, ids)
+                for signal in self.claim_unseen('parsed_signals', signals):
+                    await self.handle_parsed_signal(signal)
+            except Exception as e:
+                logger.error("❌ Ошибка обработки парсированного сигнала: %s", e)
+                
+    async def handle_parsed_signal(self, signal: Dict):
+        """Анализ парсированного сигнала"""
+        logger.info("📨 Парсированный сигнал: %s", signal['parsed_data'])
+        # TODO: Анализ и исполнение
+            
     async def command_listener(self):
         """Слушатель команд от админского бота"""
         logger.info("👂 Слушатель команд запущен")
         
+        if self.pg_listener:
+            await self.command_consumer()
+            return
+            
         while self.is_running:
             try:
-                # Проверяем команды в Supabase
-                commands = self.supabase.table("autotrade_commands") \
-                    .select("*") \
-                    .eq("processed", False) \
-                    .execute()
-                    
-                for cmd in commands.data:
-                    await self.process_command(cmd)
-                    # Помечаем как обработанную
-                    self.supabase.table("autotrade_commands") \
-                        .update({"processed": True}) \
-                        .eq("id", cmd["id"]) \
-                        .execute()
-                        
+                await self.check_commands()
                 await asyncio.sleep(10)  # Проверяем каждые 10 секунд
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка слушателя команд: {e}")
                 await asyncio.sleep(30)
                 
+    async def check_commands(self):
+        """Проверка необработанных команд в Supabase"""
+        if self.pg_pool:
+            commands = await self.pg_pool.fetch(COMMANDS_SQL)
+        else:
+            query = self.supabase.table("autotrade_commands") \
+                .select("id,command,params") \
+                .eq("processed", False)
+            commands = (await asyncio.to_thread(query.execute)).data
+            
+        await self.handle_commands(commands)
+            
+    async def command_consumer(self):
+        """Обработка команд из NOTIFY канала"""
+        try:
+            await self.check_commands()
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки команд: {e}")
+            
+        while self.is_running:
+            ids = await self.next_notified_ids('commands')
+                
+            try:
+                if ids is None:
+                    await self.check_commands()
+                    continue
+                commands = await self.pg_pool.fetch(COMMANDS_BY_ID_SQL, ids)
+                await self.handle_commands(commands)
+            except Exception as e:
+                logger.error(f"❌ Ошибка слушателя команд: {e}")
+                
+    async def handle_commands(self, commands: List[Dict]):
+        """Исполнение команд и отметка об обработке одним запросом"""
+        processed_ids = []
+        
+        # Повтор возможен, если отметка processed не дошла до базы
+        for cmd in self.unseen('commands', commands):
+            try:
+                await self.process_command(cmd)
+                processed_ids.append(cmd["id"])
+            except Exception as e:
+                logger.error("❌ Ошибка выполнения команды %s: %s", cmd.get('id'), e)
+                
+        if not processed_ids:
+            return
+        self.remember_ids('commands', processed_ids)
+            
+        # Отметка не должна прерываться отменой задачи при остановке,
+        # иначе команды будут выполнены повторно после рестарта
+        await asyncio.shield(self.mark_commands_processed(processed_ids))
+        
+    async def mark_commands_processed(self, processed_ids: List):
+        """Помечаем команды как обработанные"""
+        if self.pg_pool:
+            await self.pg_pool.execute(MARK_COMMANDS_SQL, processed_ids)
+        else:
+            query = self.supabase.table("autotrade_commands") \
+                .update({"processed": True}) \
+                .in_("id", processed_ids)
+            await asyncio.to_thread(query.execute)
+                
     async def process_command(self, cmd: Dict):
         """Обработка команды от админа"""
         command_type = cmd.get("command")
-        logger.info(f"📩 Получена команда: {command_type}")
+        logger.info("📩 Получена команда: %s", command_type)
         
         if command_type == "start_demo":
             await self.start_demo_trading()
@@ -262,31 +524,55 @@ class AmveraExecutor:
         self.is_running = False
         
         # Ожидаем завершения задач
-        for task in self.active_tasks:
+        for task in [*self.active_tasks, *self.signal_tasks]:
             if not task.done():
                 task.cancel()
                 
-        # Закрываем соединения
-        if self.telegram_parser:
-            await self.telegram_parser.close()
-            
-        if self.market_client:
-            await self.market_client.close()
-            
-        logger.info("✅ Все компоненты остановлены")
+        # Закрываем соединения: сбой одного не мешает закрыть остальные
+        closers = [
+            ("Telegram парсер", self.telegram_parser, "close"),
+            ("WebSocket клиент", self.market_client, "close"),
+            ("LISTEN", self.pg_listener, "close"),
+            ("пул Postgres", self.pg_pool, "close"),
+            ("Supabase REST", self.supabase_rest, "aclose"),
+        ]
+        try:
+            for name, component, method in closers:
+                if component is None:
+                    continue
+                try:
+                    await getattr(component, method)()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка закрытия ({name}): {e}")
+                    
+            logger.info("✅ Все компоненты остановлены")
+        finally:
+            self.stopped.set()
         
 
 async def main():
     """Главная функция"""
     executor = AmveraExecutor()
+    shutdown_tasks = []
     
-    # Обработка SIGTERM для Docker
-    def signal_handler(signum, frame):
-        logger.info(f"Получен сигнал {signum}, завершение...")
-        asyncio.create_task(executor.shutdown())
+    # Обработка SIGTERM для Docker (колбэк вызывается в контексте цикла)
+    def signal_handler(signame: str):
+        logger.info(f"Получен сигнал {signame}, завершение...")
+        if not shutdown_tasks:
+            shutdown_tasks.append(asyncio.create_task(executor.shutdown()))
         
-    signal.signal(signal.SIGTERM, signal_handler)
-    signal.signal(signal.SIGINT, signal_handler)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, signal_handler, signum.name)
+        except NotImplementedError:
+            # Windows: обработчик вызывается вне цикла, передаем в цикл
+            signal.signal(
+                signum,
+                lambda num, frame: loop.call_soon_threadsafe(
+                    signal_handler, signal.Signals(num).name
+                )
+            )
     
     # Инициализация
     if not await executor.init():
@@ -296,13 +582,16 @@ async def main():
     # Запуск задач
     await executor.start_tasks()
     
-    # Бесконечный цикл (до получения сигнала остановки)
-    while executor.is_running:
-        await asyncio.sleep(1)
+    # Ждем завершения shutdown() (после сигнала остановки)
+    await executor.stopped.wait()
         
     logger.info("👋 Amvera Executor завершил работу")
 
 
 if __name__ == "__main__":
-    load_dotenv()
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop
+    except ImportError:  # Windows / локальный запуск без uvloop
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Подписка на Postgres LISTEN/NOTIFY каналы Supabase
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import asyncpg
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Маркер в очереди: соединение LISTEN переподключено, нужна сверка
+RESYNC = None
+
+class PgNotifyListener:
+    """Слушатель NOTIFY каналов: id каждой записи попадает в очередь своего канала"""
+
+    def __init__(self, pool: asyncpg.Pool, channels: List[str]):
+        self.pool = pool
+        self.channels = channels
+        self.queues: Dict[str, asyncio.Queue] = {
+            channel: asyncio.Queue() for channel in channels
+        }
+        self.conn: Optional[asyncpg.Connection] = None
+        self.reconnect_task: Optional[asyncio.Task] = None
+        self.closing = False
+
+    async def connect(self):
+        """Подписка на каналы (соединение из пула занято до close())"""
+        self.conn = await self.pool.acquire()
+        try:
+            self.conn.add_termination_listener(self._on_termination)
+
+            for channel in self.channels:
+                await self.conn.add_listener(channel, self._on_notify)
+        except BaseException:
+            # Иначе pool.close() будет вечно ждать возврата соединения
+            await self._release()
+            raise
+
+        logger.info(f"✅ LISTEN на каналах: {', '.join(self.channels)}")
+
+    def _on_notify(self, conn, pid: int, channel: str, payload: str):
+        """Колбэк asyncpg: разбор payload и постановка id в очередь"""
+        try:
+            row_id = orjson.loads(payload)['id']
+        except (ValueError, KeyError, TypeError):
+            logger.warning("⚠️ Некорректный payload в канале %s", channel)
+            return
+
+        self.queues[channel].put_nowait(row_id)
+
+    def _on_termination(self, conn):
+        """Колбэк asyncpg: соединение LISTEN потеряно"""
+        if self.closing or self.reconnect_task:
+            return
+
+        logger.warning("⚠️ Соединение LISTEN потеряно, переподключаюсь")
+        self.reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        """Новое соединение из пула, повторный LISTEN и сигнал на сверку"""
+        await self._release()
+
+        delay = 1
+        while not self.closing:
+            try:
+                await self.connect()
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка переподключения LISTEN: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+        self.reconnect_task = None
+        if self.conn:
+            # NOTIFY за время разрыва потеряны - потребители дочитают опросом
+            for queue in self.queues.values():
+                queue.put_nowait(RESYNC)
+
+    async def _release(self):
+        """Возврат соединения в пул (закрытое пул просто отбросит)"""
+        conn, self.conn = self.conn, None
+        try:
+            conn.remove_termination_listener(self._on_termination)
+            for channel in self.channels:
+                await conn.remove_listener(channel, self._on_notify)
+            await self.pool.release(conn)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка возврата LISTEN соединения: {e}")
+
+    async def close(self):
+        """Закрытие соединения"""
+        self.closing = True
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+
+        if self.conn:
+            await self._release()
+            logger.info("✅ LISTEN соединение закрыто")
@@ -0,0 +1,32 @@
+-- Триггеры NOTIFY для событийной доставки строк в Amvera Executor
+-- Применить один раз в Supabase SQL Editor.
+-- Payload NOTIFY ограничен 8000 байт, поэтому передаем только id,
+-- а строку исполнитель дочитывает из пула Postgres.
+
+CREATE OR REPLACE FUNCTION notify_row_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], json_build_object('id', NEW.id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ai_signals_notify ON ai_signals;
+CREATE TRIGGER ai_signals_notify
+    AFTER INSERT ON ai_signals
+    FOR EACH ROW
+    WHEN (NEW.status = 'new' AND NEW.for_autotrade)
+    EXECUTE FUNCTION notify_row_insert('new_signal');
+
+DROP TRIGGER IF EXISTS parsed_signals_notify ON parsed_signals;
+CREATE TRIGGER parsed_signals_notify
+    AFTER INSERT ON parsed_signals
+    FOR EACH ROW
+    WHEN (NEW.is_trading_signal AND NOT NEW.processed)
+    EXECUTE FUNCTION notify_row_insert('parsed_signal');
+
+DROP TRIGGER IF EXISTS autotrade_commands_notify ON autotrade_commands;
+CREATE TRIGGER autotrade_commands_notify
+    AFTER INSERT ON autotrade_commands
+    FOR EACH ROW
+    WHEN (NOT NEW.processed)
+    EXECUTE FUNCTION notify_row_insert('new_command');
@@ -6,51 +6,89 @@ Telegram парсер для Amvera
 import asyncio
 import logging
 import re
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Any, Dict, FrozenSet, Optional
+
+import orjson
 from telethon import TelegramClient, events
+from telethon.sessions import StringSession
+
+from utils import now_iso
 
 logger = logging.getLogger(__name__)
 
+PROCESSED_MESSAGES_MAX = 50000  # Сколько последних сообщений помним для дедупликации
+
+@dataclass(slots=True, frozen=True)
+class Signal:
+    """Распарсенный торговый сигнал"""
+    symbol: str
+    direction: str
+    entry_price: Optional[float]
+    tp_price: Optional[float]
+    sl_price: Optional[float]
+    is_pre_signal: bool
+    raw_text: str
+    parsed_at: str
+
+class HistoryEvent:
+    """Минимальная замена NewMessage.Event для исторических сообщений"""
+    __slots__ = ('chat_id', 'message')
+    
+    def __init__(self, chat_id: int, message):
+        self.chat_id = chat_id
+        self.message = message
+
 class TelegramParser:
     """Парсер Telegram чатов"""
     
-    def __init__(self, api_id: int, api_hash: str, target_chats: List, supabase):
+    def __init__(self, api_id: int, api_hash: str, target_chats: FrozenSet[int], supabase_rest,
+                 session_string: str = ""):
         self.api_id = api_id
         self.api_hash = api_hash
+        self.session_string = session_string
         self.target_chats = target_chats
-        self.supabase = supabase
+        self.supabase_rest = supabase_rest  # httpx.AsyncClient на /rest/v1
         self.client = None
-        self.processed_messages = set()
+        self.processed_messages = OrderedDict()  # (chat_id, message_id) -> None
+        self.entity_cache: Dict[int, Any] = {}
         
         # Паттерны для парсинга
         self.patterns = {
             'symbol': r'([A-Z]{3,6}/[A-Z]{3,6}|[A-Z]{3,10}(?:USDT|BTC|ETH))',
-            'direction': r'(купить|покупаем|бай|buy|long|лонг|продать|продаем|селл|sell|short|шорт)',
+            'direction': r'(?P<buy>купить|покупаем|бай|buy|long|лонг)|(?P<sell>продать|продаем|селл|sell|short|шорт)',
             'entry': r'(вход|entry)[:\s]*([0-9.]+)',
             'tp': r'(тп|tp|target)[:\s]*([0-9.]+)',
             'sl': r'(сл|sl|stop)[:\s]*([0-9.]+)',
             'pre_signal': r'(готовность|через|сигнал через)\s*(\d+)\s*(мин|минут|min)'
         }
+        # Компилируем один раз, а не на каждое сообщение
+        self._re = {
+            name: re.compile(pattern, re.IGNORECASE)
+            for name, pattern in self.patterns.items()
+        }
         
     async def start(self):
         """Запуск парсера"""
         try:
             self.client = TelegramClient(
-                'amvera_session',
+                StringSession(self.session_string) if self.session_string else 'amvera_session',
                 self.api_id,
                 self.api_hash
             )
+            # Не пишем сущности в .session на каждое сообщение
+            self.client.session.save_entities = False
             
             await self.client.start()
             logger.info("✅ Telegram парсер запущен")
             
-            # Настройка обработчиков для каждого чата
-            for chat_id in self.target_chats:
-                @self.client.on(events.NewMessage(chats=chat_id))
-                async def handler(event):
-                    await self.process_message(event)
-                    
+            # Один обработчик на все чаты
+            @self.client.on(events.NewMessage(chats=list(self.target_chats)))
+            async def handler(event):
+                await self.process_message(event)
+                
             # Запускаем бесконечный цикл
             await self.client.run_until_disconnected()
             
@@ -60,12 +98,14 @@ class TelegramParser:
     async def process_message(self, event):
         """Обработка сообщения"""
         try:
-            message_id = f"{event.chat_id}_{event.message.id}"
+            message_key = (event.chat_id, event.message.id)
             
-            if message_id in self.processed_messages:
+            if message_key in self.processed_messages:
                 return
                 
-            self.processed_messages.add(message_id)
+            self.processed_messages[message_key] = None
+            if len(self.processed_messages) > PROCESSED_MESSAGES_MAX:
+                self.processed_messages.popitem(last=False)
             
             text = event.message.text or ""
             if not text:
@@ -77,67 +117,59 @@ class TelegramParser:
             if signal_data:
                 # Сохраняем в Supabase
                 await self.save_to_supabase(signal_data, event)
-                logger.info(f"📨 Сохранен сигнал: {signal_data.get('symbol', 'N/A')}")
+                logger.info("📨 Сохранен сигнал: %s", signal_data.symbol)
                 
         except Exception as e:
-            logger.error(f"❌ Ошибка обработки сообщения: {e}")
+            logger.error("❌ Ошибка обработки сообщения: %s", e)
             
-    def parse_signal(self, text: str) -> Optional[Dict]:
+    def parse_signal(self, text: str) -> Optional[Signal]:
         """Парсинг текста на сигнал"""
-        text_lower = text.lower()
-        
+        # Без '/' и без USDT/BTC/ETH символ найтись не может - regex не запускаем
+        if '/' not in text:
+            text_lower = text.lower()
+            if 'usdt' not in text_lower and 'btc' not in text_lower and 'eth' not in text_lower:
+                return None
+                
         # Поиск символа
-        symbol_match = re.search(self.patterns['symbol'], text, re.IGNORECASE)
+        symbol_match = self._re['symbol'].search(text)
         if not symbol_match:
             return None
             
         symbol = symbol_match.group(1).upper()
         
-        # Поиск направления
-        direction = None
-        buy_words = ['купить', 'покупаем', 'бай', 'buy', 'long', 'лонг']
-        sell_words = ['продать', 'продаем', 'селл', 'sell', 'short', 'шорт']
-        
-        for word in buy_words:
-            if word in text_lower:
-                direction = 'buy'
-                break
-                
-        if not direction:
-            for word in sell_words:
-                if word in text_lower:
-                    direction = 'sell'
-                    break
-                    
-        if not direction:
+        # Поиск направления (первое упоминание в тексте)
+        direction_match = self._re['direction'].search(text)
+        if not direction_match:
             return None
             
+        direction = 'buy' if direction_match.group('buy') else 'sell'
+            
         # Извлечение цен
         entry_price = self.extract_price(text, 'entry')
         tp_price = self.extract_price(text, 'tp')
         sl_price = self.extract_price(text, 'sl')
         
         # Проверка на пре-сигнал
-        pre_signal = re.search(self.patterns['pre_signal'], text_lower)
+        pre_signal = self._re['pre_signal'].search(text)
         
-        return {
-            'symbol': symbol,
-            'direction': direction,
-            'entry_price': entry_price,
-            'tp_price': tp_price,
-            'sl_price': sl_price,
-            'is_pre_signal': bool(pre_signal),
-            'raw_text': text,
-            'parsed_at': datetime.utcnow().isoformat()
-        }
+        return Signal(
+            symbol=symbol,
+            direction=direction,
+            entry_price=entry_price,
+            tp_price=tp_price,
+            sl_price=sl_price,
+            is_pre_signal=bool(pre_signal),
+            raw_text=text,
+            parsed_at=now_iso()
+        )
         
     def extract_price(self, text: str, price_type: str) -> Optional[float]:
         """Извлечение цены"""
-        pattern = self.patterns.get(price_type)
+        pattern = self._re.get(price_type)
         if not pattern:
             return None
             
-        match = re.search(pattern, text.lower())
+        match = pattern.search(text)
         if match and len(match.groups()) >= 2:
             try:
                 return float(match.group(2))
@@ -145,48 +177,54 @@ class TelegramParser:
                 return None
         return None
         
-    async def save_to_supabase(self, signal_data: Dict, event):
+    async def save_to_supabase(self, signal_data: Signal, event):
         """Сохранение сигнала в Supabase"""
         try:
             data = {
                 'chat_id': event.chat_id,
                 'message_id': event.message.id,
                 'date': event.message.date.isoformat(),
-                'parsed_data': signal_data,
-                'is_trading_signal': signal_data.get('symbol') and signal_data.get('direction'),
-                'is_pre_signal': signal_data.get('is_pre_signal', False),
+                'parsed_data': signal_data,  # orjson сериализует dataclass сам
+                'is_trading_signal': bool(signal_data.symbol and signal_data.direction),
+                'is_pre_signal': signal_data.is_pre_signal,
                 'processed': False,
-                'saved_at': datetime.utcnow().isoformat()
+                'saved_at': now_iso()
             }
             
-            self.supabase.table("parsed_signals").insert(data).execute()
+            response = await self.supabase_rest.post(
+                "/parsed_signals",
+                content=orjson.dumps(data)
+            )
+            response.raise_for_status()
             
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения в Supabase: {e}")
+            logger.error("❌ Ошибка сохранения в Supabase: %s", e)
             
+    async def get_entity(self, chat_id: int):
+        """Сущность чата (запрос к Telegram только при первом обращении)"""
+        entity = self.entity_cache.get(chat_id)
+        if entity is None:
+            entity = await self.client.get_entity(chat_id)
+            self.entity_cache[chat_id] = entity
+        return entity
+        
     async def parse_history(self, hours: int = 24):
         """Исторический парсинг"""
         logger.info(f"🕐 Начинаю исторический парсинг за {hours} часов")
+        from_date = datetime.utcnow() - timedelta(hours=hours)
         
         for chat_id in self.target_chats:
             try:
-                entity = await self.client.get_entity(chat_id)
-                from_date = datetime.utcnow() - timedelta(hours=hours)
+                entity = await self.get_entity(chat_id)
                 
-                messages = await self.client.get_messages(
+                # Потоково, от from_date к новым сообщениям
+                async for message in self.client.iter_messages(
                     entity,
                     limit=1000,
-                    offset_date=from_date
-                )
-                
-                for message in messages:
-                    await self.process_message(
-                        type('Event', (), {
-                            'chat_id': chat_id,
-                            'message': message,
-                            'text': message.text
-                        })()
-                    )
+                    offset_date=from_date,
+                    reverse=True
+                ):
+                    await self.process_message(HistoryEvent(chat_id, message))
                     
             except Exception as e:
                 logger.error(f"❌ Ошибка исторического парсинга чата {chat_id}: {e}")
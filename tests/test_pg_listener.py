@@ -0,0 +1,101 @@
+"""
+Тесты PgNotifyListener на заглушке пула asyncpg
+Запуск: python -m unittest
+"""
+
+import unittest
+
+from pg_listener import PgNotifyListener
+
+
+class StubConnection:
+    """Минимальное соединение asyncpg: только то, что вызывает слушатель"""
+
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+        self.fail_listen = False
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        if callback in self.termination_listeners:
+            self.termination_listeners.remove(callback)
+
+    async def add_listener(self, channel, callback):
+        if self.fail_listen:
+            raise ConnectionError('LISTEN failed')
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        self.listeners.pop(channel, None)
+
+    def is_closed(self):
+        return self.closed
+
+
+class StubPool:
+    """Пул с одним соединением, отслеживает acquire/release"""
+
+    def __init__(self):
+        self.conn = StubConnection()
+        self.acquired = 0
+
+    async def acquire(self):
+        self.acquired += 1
+        return self.conn
+
+    async def release(self, conn):
+        self.acquired -= 1
+
+
+class PgNotifyListenerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pool = StubPool()
+        self.listener = PgNotifyListener(
+            pool=self.pool, channels=['new_signal', 'new_command']
+        )
+        await self.listener.connect()
+
+    async def test_connect_listens_on_all_channels(self):
+        self.assertEqual(set(self.pool.conn.listeners), {'new_signal', 'new_command'})
+        self.assertEqual(self.pool.acquired, 1)
+
+    async def test_payload_id_goes_to_channel_queue(self):
+        callback = self.pool.conn.listeners['new_signal']
+        callback(self.pool.conn, 1, 'new_signal', '{"id": 42}')
+
+        self.assertEqual(self.listener.queues['new_signal'].get_nowait(), 42)
+        self.assertTrue(self.listener.queues['new_command'].empty())
+
+    async def test_bad_payload_is_skipped(self):
+        callback = self.pool.conn.listeners['new_signal']
+        callback(self.pool.conn, 1, 'new_signal', 'not json')
+        callback(self.pool.conn, 1, 'new_signal', '{"status": "new"}')
+
+        self.assertTrue(self.listener.queues['new_signal'].empty())
+
+    async def test_close_releases_connection(self):
+        await self.listener.close()
+
+        self.assertEqual(self.pool.acquired, 0)
+        self.assertEqual(self.pool.conn.listeners, {})
+        self.assertEqual(self.pool.conn.termination_listeners, [])
+
+    async def test_failed_connect_releases_connection(self):
+        await self.listener.close()
+        self.pool.conn.fail_listen = True
+
+        listener = PgNotifyListener(pool=self.pool, channels=['new_signal'])
+        with self.assertRaises(ConnectionError):
+            await listener.connect()
+
+        self.assertEqual(self.pool.acquired, 0)
+        self.assertIsNone(listener.conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
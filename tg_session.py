@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Одноразовая авторизация в Telegram и вывод StringSession для TG_STRING_SESSION
+"""
+
+from telethon.sessions import StringSession
+from telethon.sync import TelegramClient
+
+from config import TG_API_ID, TG_API_HASH
+
+
+def main():
+    """Вход по номеру телефона и печать строки сессии"""
+    with TelegramClient(StringSession(), TG_API_ID, TG_API_HASH) as client:
+        print("Добавьте в .env:")
+        print(f"TG_STRING_SESSION={client.session.save()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Общие утилиты Amvera модуля
+"""
+
+import time
+from datetime import datetime
+
+# [время последнего форматирования, строка ISO]
+_ts_cache = [0.0, ""]
+
+def now_iso() -> str:
+    """Текущее время UTC в ISO формате (строка переиспользуется в пределах 1 мс)"""
+    now = time.time()
+    if now - _ts_cache[0] >= 0.001:
+        _ts_cache[0] = now
+        _ts_cache[1] = datetime.utcfromtimestamp(now).isoformat()
+    return _ts_cache[1]
@@ -1,27 +1,75 @@
 #!/usr/bin/env python3
 """
 WebSocket клиент для бирж
+
+Рассчитан на запуск под uvloop (ставится в main.py), на стандартном
+asyncio цикле работает так же, но медленнее.
 """
 
 import asyncio
-import json
 import logging
 from typing import Dict, List
+import orjson
 import websockets
 
+from utils import now_iso
+
 logger = logging.getLogger(__name__)
 
+# Пакетная запись в market_data_cache
+INSERT_QUEUE_SIZE = 10000   # Максимум строк в очереди (старые вытесняются)
+INSERT_BATCH_SIZE = 500     # Максимум строк в одном insert
+INSERT_BATCH_WINDOW = 0.05  # Сколько ждать добора пакета (сек)
+MARKET_ROW_FIELDS = ('exchange', 'data', 'timestamp')  # Колонки market_data_cache
+
+# Исходящие кадры WebSocket
+SEND_QUEUE_SIZE = 1000      # Максимум кадров в очереди соединения
+SEND_BATCH_SIZE = 32        # Сколько кадров writer отправляет за один проход
+SUBSCRIBE_CHUNK_SIZE = 200  # Максимум символов в одном кадре подписки
+
 class MarketDataClient:
     """Клиент для получения рыночных данных"""
     
-    def __init__(self, exchanges: List[Dict], supabase):
+    def __init__(self, exchanges: List[Dict], supabase_rest):
         self.exchanges = exchanges
-        self.supabase = supabase
+        self.supabase_rest = supabase_rest  # httpx.AsyncClient на /rest/v1
         self.connections = {}
         self.subscriptions = {}
+        self.send_queues = {}
+        self.writer_tasks = {}
+        self.log_counter = 0
+        self.insert_queue = asyncio.Queue(maxsize=INSERT_QUEUE_SIZE)
+        self.flusher_task = None
+        self.dropped_rows = 0        # Вытеснено из переполненной очереди
+        self.drop_logged_at = 0.0    # loop.time() последнего отчета о потерях
+        
+        # Кадры подписки сериализуем один раз, а не при каждом подключении
+        self.subscribe_frames = {
+            exchange['name']: self.build_subscribe_frames(
+                exchange['symbols'], exchange['subscribe_msg']
+            )
+            for exchange in exchanges
+        }
+        
+    @staticmethod
+    def build_subscribe_frames(symbols: List[str], template: Dict) -> List[str]:
+        """Готовые JSON кадры подписки: все символы в одном кадре (по частям)"""
+        # Пример для Binance
+        return [
+            orjson.dumps({
+                **template,
+                'params': [f"{symbol}@ticker" for symbol in symbols[i:i + SUBSCRIBE_CHUNK_SIZE]]
+            }).decode()
+            for i in range(0, len(symbols), SUBSCRIBE_CHUNK_SIZE)
+        ]
         
     async def connect_all(self):
         """Подключение ко всем биржам"""
+        self.flusher_task = asyncio.create_task(
+            self.flush_inserts(),
+            name="market_data_flusher"
+        )
+        
         tasks = []
         for exchange in self.exchanges:
             tasks.append(self.connect_exchange(exchange))
@@ -32,15 +80,29 @@ class MarketDataClient:
         """Подключение к конкретной бирже"""
         name = exchange['name']
         url = exchange['ws_url']
-        symbols = exchange['symbols']
         
         try:
             logger.info(f"🔌 Подключаюсь к {name} WebSocket...")
-            websocket = await websockets.connect(url)
+            # permessage-deflate выключен: трафик больше, зато нет
+            # распаковки каждого кадра в горячем цикле приема
+            websocket = await websockets.connect(
+                url,
+                compression=None,
+                max_size=2 ** 20,
+                read_limit=2 ** 18,
+                max_queue=32  # Не читаем из сокета впрок, если не успеваем обрабатывать
+            )
             self.connections[name] = websocket
             
+            # Все отправки в соединение идут через одну очередь и один writer
+            self.send_queues[name] = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+            self.writer_tasks[name] = asyncio.create_task(
+                self.writer(websocket, self.send_queues[name], name),
+                name=f"{name}_writer"
+            )
+            
             # Подписка на символы
-            await self.subscribe(websocket, symbols, exchange['subscribe_msg'])
+            self.subscribe(name, self.subscribe_frames[name])
             
             # Запуск слушателя
             asyncio.create_task(self.listen(websocket, name))
@@ -50,52 +112,136 @@ class MarketDataClient:
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к {name}: {e}")
             
-    async def subscribe(self, websocket, symbols: List[str], template: Dict):
+    def subscribe(self, exchange_name: str, frames: List[str]):
         """Подписка на символы"""
-        for symbol in symbols:
-            msg = template.copy()
-            msg['params'] = [f"{symbol}@ticker"]  # Пример для Binance
+        for frame in frames:
+            self.send(exchange_name, frame)
+            logger.debug("📡 Подписка поставлена в очередь: %s", frame)
             
-            await websocket.send(json.dumps(msg))
-            logger.debug(f"📡 Подписан на {symbol}")
+    def send(self, exchange_name: str, frame: str):
+        """Постановка кадра в очередь отправки соединения"""
+        self.send_queues[exchange_name].put_nowait(frame)
+        
+    async def writer(self, websocket, queue: asyncio.Queue, exchange_name: str):
+        """Единственный отправитель в соединение: забирает накопившиеся кадры разом"""
+        try:
+            while True:
+                frames = [await queue.get()]
+                while len(frames) < SEND_BATCH_SIZE and not queue.empty():
+                    frames.append(queue.get_nowait())
+                    
+                for frame in frames:
+                    await websocket.send(frame)
+                    
+        except websockets.ConnectionClosed:
+            logger.warning(f"🔌 Отправка в {exchange_name} остановлена: соединение закрыто")
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки в {exchange_name}: {e}")
             
     async def listen(self, websocket, exchange_name: str):
         """Прослушивание сообщений от WebSocket"""
         try:
             async for message in websocket:
-                data = json.loads(message)
-                await self.process_message(data, exchange_name)
+                try:
+                    data = orjson.loads(message)
+                except orjson.JSONDecodeError:
+                    # Служебные/не-JSON кадры пропускаем, слушатель не останавливаем
+                    continue
+                    
+                self.process_message(data, exchange_name)
                 
         except websockets.ConnectionClosed:
             logger.warning(f"🔌 Соединение с {exchange_name} закрыто")
         except Exception as e:
             logger.error(f"❌ Ошибка в слушателе {exchange_name}: {e}")
             
-    async def process_message(self, data: Dict, exchange: str):
+    def process_message(self, data: Dict, exchange: str):
         """Обработка сообщения от WebSocket"""
         try:
-            # Сохраняем рыночные данные в Supabase
-            market_data = {
-                'exchange': exchange,
-                'data': data,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-            # Сохраняем для быстрого доступа
-            self.supabase.table("market_data_cache").insert(market_data).execute()
-            
-            # Логируем каждые 100 сообщений
-            if random.random() < 0.01:  # 1%
-                logger.debug(f"📈 {exchange}: {data.get('s', 'N/A')} - {data.get('c', 'N/A')}")
+            # Кортеж в порядке MARKET_ROW_FIELDS, dict собирается при записи
+            market_data = (exchange, data, now_iso())
+            
+            # В Supabase пишет flush_inserts() пакетами
+            try:
+                self.insert_queue.put_nowait(market_data)
+            except asyncio.QueueFull:
+                # Вытесняем самую старую запись - свежие котировки важнее
+                self.insert_queue.get_nowait()
+                self.insert_queue.put_nowait(market_data)
+                self.dropped_rows += 1
+            
+            # Логируем каждое 256-е сообщение
+            self.log_counter = (self.log_counter + 1) & 0xFF
+            if not self.log_counter and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📈 %s: %s - %s", exchange, data.get('s', 'N/A'), data.get('c', 'N/A'))
+                
+        except Exception as e:
+            logger.error("❌ Ошибка обработки WebSocket сообщения: %s", e)
+            
+    async def flush_inserts(self):
+        """Фоновая пакетная запись рыночных данных в Supabase"""
+        loop = asyncio.get_running_loop()
+        queue = self.insert_queue
+        
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + INSERT_BATCH_WINDOW
+            
+            # Добираем пакет по размеру или по времени
+            while len(batch) < INSERT_BATCH_SIZE:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                    
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                    
+            await self.insert_batch(batch)
+            
+            # Отчет о потерях не чаще раза в секунду
+            if self.dropped_rows and loop.time() - self.drop_logged_at >= 1:
+                logger.warning("⚠️ Supabase не успевает: вытеснено %s строк рыночных данных", self.dropped_rows)
+                self.dropped_rows = 0
+                self.drop_logged_at = loop.time()
                 
+    async def insert_batch(self, batch: List[tuple]):
+        """Один insert на пакет (тело сериализуем orjson)"""
+        try:
+            rows = [dict(zip(MARKET_ROW_FIELDS, row)) for row in batch]
+            response = await self.supabase_rest.post(
+                "/market_data_cache",
+                content=orjson.dumps(rows)
+            )
+            response.raise_for_status()
         except Exception as e:
-            logger.error(f"❌ Ошибка обработки WebSocket сообщения: {e}")
+            logger.error("❌ Ошибка записи пакета (%s строк) в Supabase: %s", len(batch), e)
             
     async def close(self):
         """Закрытие всех соединений"""
+        for task in self.writer_tasks.values():
+            task.cancel()
+            
         for name, ws in self.connections.items():
             try:
                 await ws.close()
                 logger.info(f"🔌 Соединение с {name} закрыто")
             except:
-                pass
\ No newline at end of file
+                pass
+                
+        if self.flusher_task:
+            self.flusher_task.cancel()
+            
+        # Дописываем то, что осталось в очереди
+        batch = []
+        while not self.insert_queue.empty():
+            batch.append(self.insert_queue.get_nowait())
+            if len(batch) == INSERT_BATCH_SIZE:
+                await self.insert_batch(batch)
+                batch = []
+        if batch:
+            await self.insert_batch(batch)
\ No newline at end of file